@@ -0,0 +1,444 @@
+"""
+Micro-benchmarks for the CPU hot paths of page generation.
+
+Each benchmark uses synthetic fixtures sized like the production happi
+database: large storage-format pages, PV-heavy devices, and thousands of
+happi items.  Throughput (calls/sec) and peak memory of a single call are
+measured for each, and appended to a history file so that results may be
+compared over time.
+
+Usage::
+
+    $ python benchmarks/hot_paths.py                 # run everything
+    $ python benchmarks/hot_paths.py -k render       # run matching benchmarks
+    $ python benchmarks/hot_paths.py --no-save       # don't record results
+
+The run fails (exit code 1) if any benchmark is slower than its baseline by
+more than ``--threshold``, or its peak memory grew by more than
+``--memory-threshold``.  The baseline is the median of the last
+``BASELINE_RUNS`` results recorded on the same host with the same Python
+version.  Results of a failing run are not recorded (and so do not become
+part of the baseline) unless ``--save-regressions`` is given.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import inspect
+import json
+import os
+import pathlib
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import generate  # noqa: E402
+
+HISTORY_PATH = REPO_ROOT / "benchmarks" / "history.jsonl"
+# diff_pages writes its output files here; a temporary directory in main():
+SCRATCH_PATH: Optional[pathlib.Path] = None
+DEFAULT_THRESHOLD = 1.25
+DEFAULT_MEMORY_THRESHOLD = 1.25
+# Compare against the median of this many previous results:
+BASELINE_RUNS = 5
+# Aim to spend about this long timing each benchmark:
+TARGET_SECONDS = 1.0
+
+NUM_HAPPI_ITEMS = 3000
+NUM_PVS_PER_DEVICE = 400
+# Every row of the diffed pages differs (as after a Confluence round trip),
+# which makes difflib far slower than for a single change:
+NUM_PAGE_ROWS = 300
+BEAMLINES = ["TMO", "RIX", "TXI", "XPP", "XCS", "MFX", "CXI", "MEC", "LFE", "KFE"]
+KINDS = ["Kind.hinted", "Kind.normal", "Kind.config", "Kind.omitted"]
+
+
+def make_records(rng: random.Random, device: str, count: int) -> List[dict]:
+    """whatrecord-style PV records for a device."""
+    return [
+        {
+            "name": f"{device.upper()}:{rng.choice(['MMS', 'GCC', 'PTM'])}:{idx:04d}",
+            "kind": rng.choice(KINDS),
+            "signal": f"component_{idx}.readback",
+        }
+        for idx in range(count)
+    ]
+
+
+def make_happi_item(rng: random.Random, idx: int, num_pvs: int = 0) -> dict:
+    """A happi item as found in happi_info.json."""
+    name = f"device_{idx:05d}"
+    return {
+        "name": name,
+        "device_class": f"pcdsdevices.fake.FakeDevice{idx % 150}",
+        "args": ["{{prefix}}"],
+        "kwargs": {"name": "{{name}}", "timeout": "5.0"},
+        "prefix": f"{rng.choice(BEAMLINES)}:DEV:{idx:05d}",
+        "beamline": rng.choice(BEAMLINES + [None]),
+        "z": rng.uniform(0, 1000),
+        "last_edit": "2022-01-01T00:00:00",
+        "documentation": "Some documentation with <special> & \"characters\"",
+        "_whatrecord": {"records": make_records(rng, name, num_pvs)},
+    }
+
+
+def make_item_state(rng: random.Random, count: int) -> Dict[str, dict]:
+    """The state after rendering all device pages, as given to the views."""
+    state = {"_related_pages": {}}
+    for idx in range(count):
+        happi_item = make_happi_item(rng, idx)
+        state[happi_item["name"]] = {
+            "happi_item": happi_item,
+            "class.template": {"id": str(idx * 3), "title": f"FakeDevice{idx}"},
+            "device.template": {"id": str(idx * 3 + 1), "title": happi_item["name"]},
+            "user.template": {"id": str(idx * 3 + 2), "title": "notes"},
+        }
+    return state
+
+
+def make_storage_page(rng: random.Random, rows: int, stored: bool = False) -> str:
+    """
+    A large Confluence storage-format page.
+
+    With ``stored``, the page is as Confluence gives it back after an upload:
+    macro IDs are added, empty tags are normalized, and blank lines dropped.
+    """
+    def macro_attrs(idx: int) -> str:
+        if not stored:
+            return ""
+        return f' ac:schema-version="1" ac:macro-id="{idx:08x}-0000-1111-2222-333344445555"'
+
+    empty_tag_end = "/>" if stored else " />"
+    lines = [
+        f'<ac:structured-macro ac:name="toc"{macro_attrs(0)}>',
+        '<ac:parameter ac:name="minLevel">2</ac:parameter>',
+        "</ac:structured-macro>",
+        "<table><tbody>",
+    ]
+    for idx in range(rows):
+        lines.extend([
+            "<tr>",
+            f"<td>device_{idx:05d}</td>",
+            "<td>Motor &amp; encoder</td>",
+            "<td>",
+            "<ac:link>",
+            f'<ri:page ri:content-title="device_{idx:05d}"{empty_tag_end}',
+            "</ac:link>",
+            f'<ac:structured-macro ac:name="status"{macro_attrs(idx + 1)}>',
+            '<ac:parameter ac:name="title">OK</ac:parameter>',
+            "</ac:structured-macro>",
+            "</td>",
+            f'<td><a href="/pages/viewpage.action?pageId={rng.randint(0, 1e9)}">View</a></td>',
+            f"<td>{rng.uniform(0, 1000):.3f}</td>",
+            "</tr>",
+        ])
+        if not stored:
+            lines.append("")
+    lines.append("</tbody></table>")
+    return "\n".join(lines)
+
+
+class FakeDevice:
+    """
+    A device with a large signature, like many in pcdsdevices.
+
+    Parameters
+    ----------
+    prefix : str
+        The PV prefix.
+
+    name : str
+        The device name.
+    """
+
+    def __init__(
+        self, prefix, *, name, timeout=1.0, read_attrs=None,
+        configuration_attrs=None, parent=None, kind=None,
+        **kwargs
+    ):
+        ...
+
+
+def bench_confluence_escape() -> Callable[[], object]:
+    value = 'Some <b>documentation</b> with "quotes" & \'apostrophes\' ' * 20
+    return lambda: generate.confluence_escape(value)
+
+
+def bench_best_effort_get_args() -> Callable[[], object]:
+    happi_item = make_happi_item(random.Random(0), 0)
+    signature = inspect.signature(FakeDevice)
+    return lambda: generate.best_effort_get_args(signature, happi_item)
+
+
+def bench_render_device_page() -> Callable[[], object]:
+    rng = random.Random(0)
+    happi_item = make_happi_item(rng, 0, num_pvs=NUM_PVS_PER_DEVICE)
+    name = happi_item["name"]
+    pv_index = generate.PVIndex.from_happi_items({name: happi_item})
+    template = generate.NamedTemplate("device.template")
+    render_kw = dict(
+        identifier=name,
+        device_name=name,
+        happi_item=happi_item,
+        device_class="FakeDevice",
+        device_class_doc=inspect.getdoc(FakeDevice),
+        relevant_pvs_by_kind=pv_index.pvs_by_kind(name),
+        page_title_marker=generate.PAGE_TITLE_MARKER,
+        user_page_suffix=generate.USER_PAGE_SUFFIX,
+        root_page=generate.DOCUMENTATION_ROOT_TITLE,
+        related_pages=[],
+        state={},
+        item_state={"class.template": {"id": "1", "title": "FakeDevice"}},
+        confluence_url=generate.CONFLUENCE_URL,
+    )
+    template.load()
+    return lambda: template.render(**render_kw)
+
+
+def bench_render_view_page() -> Callable[[], object]:
+    state = make_item_state(random.Random(0), NUM_HAPPI_ITEMS)
+    template = generate.NamedTemplate("all_devices_by_hutch.template")
+    render_kw = generate.get_view_render_kwargs(template, {}, state)
+    render_kw["paginated"] = False
+    template.load()
+    return lambda: template.render(**render_kw)
+
+
+def bench_render_hutch_pages() -> Callable[[], object]:
+    """All of the group pages of the paginated ``hutch_devices`` view."""
+    state = make_item_state(random.Random(0), NUM_HAPPI_ITEMS)
+    template = generate.NamedTemplate("hutch_devices.template")
+    view_kw = generate.get_view_render_kwargs(template, {}, state)
+    view_kw["paginated"] = True
+    groups = generate.split_by_key(state, key="beamline", include_none=True)
+    render_kws = [
+        dict(
+            view_kw,
+            identifier=f"{view_kw['identifier']}/{group}",
+            group=group,
+            group_items=group_items,
+        )
+        for group, group_items in sorted(groups.items())
+    ]
+    template.load()
+    return lambda: [template.render(**render_kw) for render_kw in render_kws]
+
+
+def bench_split_by_key() -> Callable[[], object]:
+    state = make_item_state(random.Random(0), NUM_HAPPI_ITEMS)
+    return lambda: generate.split_by_key(state, key="beamline")
+
+
+def bench_pv_index() -> Callable[[], object]:
+    rng = random.Random(0)
+    md_by_key = {
+        f"device_{idx:05d}": make_happi_item(rng, idx, num_pvs=20)
+        for idx in range(NUM_HAPPI_ITEMS)
+    }
+    return lambda: generate.PVIndex.from_happi_items(md_by_key)
+
+
+def _diff_fixture(changed: bool):
+    # The macro IDs, tags, and blank lines Confluence rewrites on every row
+    # are ignored by check_diff, but still make for a large diff to walk.
+    existing = make_storage_page(random.Random(0), NUM_PAGE_ROWS, stored=True)
+    new = make_storage_page(random.Random(0), NUM_PAGE_ROWS)
+    if changed:
+        new = new.replace("<td>device_00150</td>", "<td>device_renamed</td>")
+    return existing, new
+
+
+def bench_check_diff() -> Callable[[], object]:
+    existing, new = _diff_fixture(changed=False)
+    page_diff = generate.diff_pages(SCRATCH_PATH, "bench", existing, new)
+    assert generate.check_diff(existing, new, page_diff)
+    return lambda: generate.check_diff(existing, new, page_diff)
+
+
+def bench_diff_pages() -> Callable[[], object]:
+    existing, new = _diff_fixture(changed=True)
+    return lambda: generate.diff_pages(SCRATCH_PATH, "bench", existing, new)
+
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {
+    "confluence_escape": bench_confluence_escape,
+    "best_effort_get_args": bench_best_effort_get_args,
+    "render_device_page": bench_render_device_page,
+    "render_view_page": bench_render_view_page,
+    "render_hutch_pages": bench_render_hutch_pages,
+    "split_by_key": bench_split_by_key,
+    "pv_index": bench_pv_index,
+    "check_diff": bench_check_diff,
+    "diff_pages": bench_diff_pages,
+}
+
+
+def measure(func: Callable[[], object]) -> dict:
+    """Measure throughput and the peak memory of a single call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    repeat = max(3, int(TARGET_SECONDS / max(timer.timeit(number), 1e-9)))
+    best = min(timer.repeat(repeat=min(repeat, 10), number=number)) / number
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds_per_call": best,
+        "calls_per_second": 1.0 / best,
+        "peak_memory_bytes": peak,
+    }
+
+
+def get_git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def load_baselines(
+    path: pathlib.Path, host: str, python: str, runs: int = BASELINE_RUNS
+) -> Dict[str, dict]:
+    """
+    The baseline result of each benchmark on ``host``.
+
+    This is the median time and peak memory of the last ``runs`` recorded
+    results, so that a single noisy run does not move it much.  Results
+    from other hosts or Python versions are not comparable, and so are
+    skipped.
+    """
+    history = {}
+    try:
+        with open(path, "rt") as fp:
+            for line in fp:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get("host") == host and record.get("python") == python:
+                        history.setdefault(record["name"], []).append(record)
+    except FileNotFoundError:
+        ...
+
+    return {
+        name: {
+            key: statistics.median(record[key] for record in records[-runs:])
+            for key in ("seconds_per_call", "peak_memory_bytes")
+        }
+        for name, records in history.items()
+    }
+
+
+def run_benchmarks(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "-k", dest="pattern", default="",
+        help="Only run benchmarks with names containing this",
+    )
+    parser.add_argument("--history", type=pathlib.Path, default=HISTORY_PATH)
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="Fail if slower than the previous result by this factor",
+    )
+    parser.add_argument(
+        "--memory-threshold", type=float, default=DEFAULT_MEMORY_THRESHOLD,
+        help="Fail if peak memory grew from the previous result by this factor",
+    )
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument(
+        "--save-regressions", action="store_true",
+        help="Record the results even if some regressed (e.g., when expected)",
+    )
+    args = parser.parse_args(argv)
+
+    common = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": get_git_revision(),
+        "python": platform.python_version(),
+        "host": platform.node(),
+    }
+    previous = load_baselines(
+        args.history, host=common["host"], python=common["python"]
+    )
+
+    regressions = []
+    records = []
+    print(
+        f"{'benchmark':25s} {'calls/sec':>12s} {'usec/call':>12s} {'peak KiB':>10s} "
+        f"{'time vs. base':>14s} {'memory vs. base':>16s}"
+    )
+    for name, setup in BENCHMARKS.items():
+        if args.pattern not in name:
+            continue
+
+        result = measure(setup())
+        record = dict(common, name=name, **result)
+        records.append(record)
+
+        time_ratio = memory_ratio = ""
+        if name in previous:
+            slowdown = result["seconds_per_call"] / previous[name]["seconds_per_call"]
+            growth = result["peak_memory_bytes"] / max(previous[name]["peak_memory_bytes"], 1)
+            time_ratio = f"{slowdown:.2f}x"
+            memory_ratio = f"{growth:.2f}x"
+            if slowdown > args.threshold:
+                regressions.append(f"{name} (time)")
+                time_ratio += " REGRESSION"
+            if growth > args.memory_threshold:
+                regressions.append(f"{name} (memory)")
+                memory_ratio += " REGRESSION"
+
+        print(
+            f"{name:25s} {result['calls_per_second']:12.1f} "
+            f"{result['seconds_per_call'] * 1e6:12.1f} "
+            f"{result['peak_memory_bytes'] / 1024:10.1f} "
+            f"{time_ratio:>14s} {memory_ratio:>16s}"
+        )
+
+    if args.no_save:
+        ...
+    elif regressions and not args.save_regressions:
+        print("Not recording the results; use --save-regressions to do so anyway")
+    else:
+        args.history.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.history, "at") as fp:
+            for record in records:
+                print(json.dumps(record, sort_keys=True), file=fp)
+
+    if regressions:
+        print(f"Regressed from the baseline on this host: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    global SCRATCH_PATH
+
+    # Templates are found relative to the repository root:
+    os.chdir(REPO_ROOT)
+    SCRATCH_PATH = pathlib.Path(tempfile.mkdtemp(prefix="happi-to-confluence-bench-"))
+    try:
+        return run_benchmarks(argv)
+    finally:
+        shutil.rmtree(SCRATCH_PATH, ignore_errors=True)
+        SCRATCH_PATH = None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""
+An asynchronous Confluence client for the endpoints happi-to-confluence uses.
+
+This mirrors the subset of ``atlassian.Confluence`` used in ``generate.py``
+(same method names, arguments, and return values), but is built on
+``httpx`` with HTTP/2 enabled.  Many requests are multiplexed over a small
+number of connections, so hundreds of requests may be in flight from a
+single thread.
+
+This is optional and requires ``httpx`` with HTTP/2 support::
+
+    $ pip install "httpx[http2]"
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import (TYPE_CHECKING, Any, Awaitable, Dict, Iterable, List,
+                    Optional, TypeVar)
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP/2 multiplexes many streams over each connection; a few suffice.
+DEFAULT_MAX_CONNECTIONS = 4
+# The number of requests in flight at once, across all connections.
+DEFAULT_MAX_IN_FLIGHT = 200
+DEFAULT_TIMEOUT = 60.0
+
+
+class AsyncConfluence:
+    """
+    Asynchronous Confluence REST API client using HTTP/2.
+
+    Use as an async context manager so that connections are closed::
+
+        async with AsyncConfluence(url, token) as client:
+            page = await client.get_page_by_title(space, title)
+
+    Parameters
+    ----------
+    url : str
+        The confluence URL.
+
+    token : str, optional
+        The token with read/write permissions.  Defaults to the
+        ``CONFLUENCE_TOKEN`` environment variable.
+
+    max_connections : int, optional
+        The maximum number of connections to the server.
+
+    max_in_flight : int, optional
+        The maximum number of outstanding requests.
+
+    timeout : float, optional
+        Per-request timeout, in seconds.
+    """
+    url: str
+    session: httpx.AsyncClient
+
+    def __init__(
+        self,
+        url: str,
+        token: Optional[str] = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        import httpx
+
+        if token is None:
+            token = os.environ.get("CONFLUENCE_TOKEN", "")
+        if not token:
+            raise RuntimeError("CONFLUENCE_TOKEN must be set to talk to Confluence")
+
+        self.url = url.rstrip("/")
+        self.session = httpx.AsyncClient(
+            base_url=self.url,
+            http2=True,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def __aenter__(self) -> AsyncConfluence:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close all connections."""
+        await self.session.aclose()
+
+    def __repr__(self):
+        return f"<AsyncConfluence {self.url}>"
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Any] = None,
+    ) -> Any:
+        """Make a request, returning the decoded JSON response."""
+        if params is not None:
+            params = {
+                key: value for key, value in params.items() if value is not None
+            }
+        async with self._in_flight:
+            response = await self.session.request(
+                method, path, params=params, json=json
+            )
+        response.raise_for_status()
+        if not response.content:
+            return None
+        return response.json()
+
+    async def get_page_by_title(
+        self,
+        space: str,
+        title: str,
+        start: int = 0,
+        limit: int = 1,
+        expand: Optional[str] = None,
+    ) -> Optional[dict]:
+        """
+        Get a page by its title.
+
+        Returns
+        -------
+        dict or None
+            The page information if ``limit`` is 1, or else the list of
+            results.  None if no such page exists.
+        """
+        response = await self._request(
+            "GET",
+            "rest/api/content",
+            params=dict(
+                type="page", spaceKey=space, title=title, start=start,
+                limit=limit, expand=expand,
+            ),
+        )
+        results = response.get("results", [])
+        if limit == 1:
+            return results[0] if results else None
+        return results
+
+    async def get_page_by_id(
+        self, page_id: str, expand: Optional[str] = None
+    ) -> dict:
+        """Get page information by its ID."""
+        return await self._request(
+            "GET", f"rest/api/content/{page_id}", params=dict(expand=expand)
+        )
+
+    async def cql(
+        self,
+        cql: str,
+        start: int = 0,
+        limit: Optional[int] = None,
+        expand: Optional[str] = None,
+    ) -> dict:
+        """Search for content with a CQL query."""
+        return await self._request(
+            "GET",
+            "rest/api/search",
+            params=dict(cql=cql, start=start, limit=limit, expand=expand),
+        )
+
+    async def get_page_labels(
+        self,
+        page_id: str,
+        prefix: Optional[str] = None,
+        start: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """Get the labels of a page."""
+        return await self._request(
+            "GET",
+            f"rest/api/content/{page_id}/label",
+            params=dict(prefix=prefix, start=start, limit=limit),
+        )
+
+    async def set_page_label(self, page_id: str, label: str) -> dict:
+        """Add a global label to a page."""
+        return await self._request(
+            "POST",
+            f"rest/api/content/{page_id}/label",
+            json=[{"prefix": "global", "name": label}],
+        )
+
+    async def get_parent_content_id(self, page_id: str) -> Optional[str]:
+        """Get the ID of the parent of the given page, if it has one."""
+        page = await self.get_page_by_id(page_id, expand="ancestors")
+        ancestors = page.get("ancestors", [])
+        return ancestors[-1]["id"] if ancestors else None
+
+    async def create_page(
+        self,
+        space: str,
+        title: str,
+        body: str,
+        parent_id: Optional[str] = None,
+        representation: str = "storage",
+    ) -> dict:
+        """Create a new page in ``space`` under ``parent_id``."""
+        data = {
+            "type": "page",
+            "title": title,
+            "space": {"key": space},
+            "body": {
+                representation: {
+                    "value": body,
+                    "representation": representation,
+                },
+            },
+        }
+        if parent_id:
+            data["ancestors"] = [{"type": "page", "id": parent_id}]
+        return await self._request("POST", "rest/api/content", json=data)
+
+    async def update_page(
+        self,
+        page_id: str,
+        title: str,
+        body: str,
+        parent_id: Optional[str] = None,
+        representation: str = "storage",
+        minor_edit: bool = False,
+        version_comment: Optional[str] = None,
+    ) -> dict:
+        """Update an existing page, bumping its version."""
+        page = await self.get_page_by_id(page_id, expand="version")
+        version = {
+            "number": page["version"]["number"] + 1,
+            "minorEdit": minor_edit,
+        }
+        if version_comment:
+            version["message"] = version_comment
+
+        data = {
+            "id": page_id,
+            "type": "page",
+            "title": title,
+            "body": {
+                representation: {
+                    "value": body,
+                    "representation": representation,
+                },
+            },
+            "version": version,
+        }
+        if parent_id:
+            data["ancestors"] = [{"type": "page", "id": parent_id}]
+        return await self._request(
+            "PUT",
+            f"rest/api/content/{page_id}",
+            params=dict(status="current"),
+            json=data,
+        )
+
+    async def update_or_create(
+        self,
+        parent_id: str,
+        title: str,
+        body: str,
+        representation: str = "storage",
+        minor_edit: bool = False,
+        version_comment: Optional[str] = None,
+    ) -> dict:
+        """
+        Update the page ``title`` in the space of ``parent_id``, or create it.
+
+        The page is (re-)parented under ``parent_id`` in either case.
+        """
+        parent = await self.get_page_by_id(parent_id, expand="space")
+        space = parent["space"]["key"]
+        existing = await self.get_page_by_title(space=space, title=title)
+        if existing is None:
+            return await self.create_page(
+                space=space,
+                title=title,
+                body=body,
+                parent_id=parent_id,
+                representation=representation,
+            )
+
+        return await self.update_page(
+            existing["id"],
+            title=title,
+            body=body,
+            parent_id=parent_id,
+            representation=representation,
+            minor_edit=minor_edit,
+            version_comment=version_comment,
+        )
+
+
+async def gather(
+    awaitables: Iterable[Awaitable[T]], return_exceptions: bool = True
+) -> List[T]:
+    """
+    Run many requests concurrently, keeping results in order.
+
+    By default, a failed request gives its exception as the result rather
+    than cancelling all of the others.
+    """
+    return await asyncio.gather(
+        *awaitables, return_exceptions=return_exceptions
+    )
+
+
+async def search_all(
+    client: AsyncConfluence,
+    cql: str,
+    expand: Optional[str] = None,
+    page_size: int = 50,
+) -> List[dict]:
+    """
+    Get the content of all results of a CQL query.
+
+    The first page of results gives the total number of results; the rest
+    of the pages are then requested concurrently.
+    """
+    first = await client.cql(cql, start=0, limit=page_size, expand=expand)
+    results = list(first.get("results", []))
+    if not results:
+        return []
+
+    # The server may return fewer results per page than asked for
+    step = len(results)
+    pages = await gather(
+        (
+            client.cql(cql, start=start, limit=step, expand=expand)
+            for start in range(step, first.get("totalSize", step), step)
+        ),
+        return_exceptions=False,
+    )
+    for page in pages:
+        results.extend(page.get("results", []))
+    return [result["content"] for result in results]
+
+
+async def get_pages_by_title(
+    client: AsyncConfluence,
+    space: str,
+    titles: Iterable[str],
+    expand: Optional[str] = None,
+) -> Dict[str, Optional[dict]]:
+    """
+    Get many pages by title concurrently.
+
+    Returns
+    -------
+    dict
+        Title to page information (or None, if missing).  Titles that could
+        not be retrieved are logged and omitted.
+    """
+    titles = list(titles)
+    pages = await gather(
+        client.get_page_by_title(space=space, title=title, expand=expand)
+        for title in titles
+    )
+    result = {}
+    for title, page in zip(titles, pages):
+        if isinstance(page, Exception):
+            logger.warning("Failed to get page %r: %s", title, page)
+        else:
+            result[title] = page
+    return result
@@ -0,0 +1,394 @@
+"""
+A local sqlite mirror of the Confluence pages generated by happi-to-confluence.
+
+The mirror holds the ID, title, version, labels, ancestors and storage-format
+body of every page with a given label (``happi-to-confluence``) in a space.
+It is brought up to date incrementally by asking Confluence only for the
+bodies of pages modified since the last sync, so the cost of a run depends on
+how many pages changed remotely rather than the size of the space.  The IDs
+and labels of all labeled pages are listed on every sync (a cheap query
+without bodies), so that deleted pages, pages that lost the label, and label
+changes - which do not count as modifications - are picked up too.
+If ``httpx`` is available, the pages of search results are downloaded
+concurrently with ``confluence_async.AsyncConfluence``.
+
+``MirroredConfluence`` wraps an ``atlassian.Confluence`` client so that
+page lookups are answered from the mirror where possible, and writes are
+reflected in the mirror.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import logging
+import pathlib
+import sqlite3
+from typing import Any, Dict, List, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+# CQL lastmodified has minute resolution and uses the server time zone; a
+# generous overlap with the last sync makes sure no changes are missed.
+SYNC_OVERLAP = datetime.timedelta(days=1)
+SYNC_PAGE_SIZE = 50
+# Listing only IDs and labels is cheap enough for larger pages of results:
+SYNC_LABELS_PAGE_SIZE = 200
+SYNC_LABELS_EXPAND = "content.metadata.labels"
+SYNC_EXPAND = ",".join(
+    (
+        "content.body.storage",
+        "content.version",
+        "content.metadata.labels",
+        "content.ancestors",
+        "content.space",
+    )
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id TEXT PRIMARY KEY,
+    space TEXT NOT NULL,
+    title TEXT NOT NULL,
+    version INTEGER,
+    labels TEXT NOT NULL,
+    ancestors TEXT NOT NULL,
+    body TEXT
+);
+CREATE INDEX IF NOT EXISTS pages_by_title ON pages (space, title);
+CREATE TABLE IF NOT EXISTS syncs (
+    space TEXT NOT NULL,
+    label TEXT NOT NULL,
+    last_sync TEXT NOT NULL,
+    PRIMARY KEY (space, label)
+);
+"""
+
+
+class ConfluenceMirror:
+    """
+    A local sqlite mirror of labeled pages in Confluence spaces.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The sqlite database filename.  Created if it does not exist.
+
+    label : str
+        Only pages with this label are mirrored.
+    """
+    path: pathlib.Path
+    label: str
+    db: sqlite3.Connection
+
+    def __init__(self, path: Union[str, pathlib.Path], label: str):
+        self.path = pathlib.Path(path)
+        self.label = label
+        self.db = sqlite3.connect(str(self.path))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f"<ConfluenceMirror {self.path} label={self.label!r}>"
+
+    def close(self) -> None:
+        self.db.close()
+
+    def get_last_sync(self, space: str) -> Optional[datetime.datetime]:
+        """The (UTC) time the last sync of ``space`` started, if any."""
+        row = self.db.execute(
+            "SELECT last_sync FROM syncs WHERE space = ? AND label = ?",
+            (space, self.label),
+        ).fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.fromisoformat(row["last_sync"])
+
+    def sync(self, client, space: str, full: bool = False) -> int:
+        """
+        Bring the mirror of ``space`` up to date.
+
+        Parameters
+        ----------
+        client : atlassian.Confluence
+            The Confluence client.
+
+        space : str
+            The space key.
+
+        full : bool, optional
+            Download every page rather than only those modified since the
+            last sync.  This is the default if ``space`` was never synced.
+            Either way, pages that no longer exist (or lost the label) are
+            forgotten and the labels of all mirrored pages are refreshed.
+
+        Returns
+        -------
+        int
+            The number of pages downloaded.
+        """
+        started = datetime.datetime.now(datetime.timezone.utc)
+        last_sync = None if full else self.get_last_sync(space)
+        labeled_query = f'space = "{space}" and type = page and label = "{self.label}"'
+        query = labeled_query
+        if last_sync is not None:
+            since = (last_sync - SYNC_OVERLAP).strftime("%Y/%m/%d %H:%M")
+            query += f' and lastmodified > "{since}"'
+            logger.info("Syncing pages in %s modified since %s", space, since)
+        else:
+            logger.info("Syncing all pages in %s", space)
+
+        seen = set()
+        for content in self._search_all(client, query, SYNC_EXPAND, SYNC_PAGE_SIZE):
+            self.store_page(content, space=space)
+            seen.add(str(content["id"]))
+
+        # A full download already has every labeled page and its labels
+        labels_by_id = {}
+        if last_sync is not None:
+            for content in self._search_all(
+                client, labeled_query, SYNC_LABELS_EXPAND, SYNC_LABELS_PAGE_SIZE
+            ):
+                labels_by_id[str(content["id"])] = self._get_labels(content) or []
+
+        with self.db:
+            self._forget_all_but(space, seen | set(labels_by_id))
+            self.db.executemany(
+                "UPDATE pages SET labels = ? WHERE id = ?",
+                [
+                    (json.dumps(sorted(set(labels))), page_id)
+                    for page_id, labels in labels_by_id.items()
+                    if page_id not in seen
+                ],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO syncs (space, label, last_sync) "
+                "VALUES (?, ?, ?)",
+                (space, self.label, started.isoformat()),
+            )
+
+        logger.info("Synced %d pages in %s", len(seen), space)
+        return len(seen)
+
+    @classmethod
+    def _search_all(cls, client, query: str, expand: str, page_size: int):
+        """
+        Get the content of all results of a CQL query.
+
+        Pages of results are requested concurrently if ``httpx`` is
+        available, or else one by one with ``client``.
+        """
+        from confluence_async import AsyncConfluence, search_all
+
+        async def download():
+            async with AsyncConfluence(client.url) as async_client:
+                return await search_all(async_client, query, expand, page_size)
+
+        try:
+            return asyncio.run(download())
+        except ImportError:
+            logger.debug("httpx[http2] is unavailable; searching sequentially")
+        return list(cls._search(client, query, expand, page_size))
+
+    @staticmethod
+    def _search(client, query: str, expand: str, page_size: int):
+        """Yield the content of all results of a CQL query."""
+        start = 0
+        while True:
+            response = client.cql(
+                query, start=start, limit=page_size, expand=expand
+            )
+            results = response.get("results", [])
+            for result in results:
+                yield result["content"]
+
+            start += len(results)
+            if not results or start >= response.get("totalSize", start):
+                break
+
+    @staticmethod
+    def _get_labels(content: dict) -> Optional[List[str]]:
+        """The label names in API content information, if included."""
+        label_info = content.get("metadata", {}).get("labels", None)
+        if label_info is None:
+            return None
+        return [label["name"] for label in label_info.get("results", [])]
+
+    def _forget_all_but(self, space: str, page_ids: Set[str]) -> None:
+        known = {
+            row["id"]
+            for row in self.db.execute("SELECT id FROM pages WHERE space = ?", (space, ))
+        }
+        stale = known - page_ids
+        if stale:
+            logger.info("Removing %d pages from the mirror of %s", len(stale), space)
+            self.db.executemany(
+                "DELETE FROM pages WHERE id = ?", [(page_id, ) for page_id in stale]
+            )
+
+    def store_page(
+        self,
+        content: dict,
+        space: Optional[str] = None,
+        body: Optional[str] = None,
+        labels: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Add or update a page from its Confluence API content information.
+
+        ``body`` and ``labels`` override those in ``content``, if provided.
+        """
+        page_id = str(content["id"])
+        existing = self.get_page_by_id(page_id)
+        space = content.get("space", {}).get("key", space)
+        if space is None and existing is not None:
+            space = existing["space"]
+        if space is None:
+            logger.debug("Not mirroring page %s with no known space", page_id)
+            return
+
+        if body is None:
+            body = content.get("body", {}).get("storage", {}).get("value", None)
+        if body is None and existing is not None:
+            body = existing["body"]["storage"]["value"]
+
+        if labels is None:
+            labels = self._get_labels(content)
+        if labels is None:
+            labels = existing["labels"] if existing is not None else []
+
+        if "ancestors" in content:
+            ancestors = [str(ancestor["id"]) for ancestor in content["ancestors"]]
+        elif existing is not None:
+            ancestors = existing["ancestors"]
+        else:
+            ancestors = []
+
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(id, space, title, version, labels, ancestors, body) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    page_id,
+                    space,
+                    content["title"],
+                    content.get("version", {}).get("number", None),
+                    json.dumps(sorted(set(labels))),
+                    json.dumps(ancestors),
+                    body,
+                ),
+            )
+
+    def add_label(self, page_id: str, label: str) -> None:
+        """Record that ``label`` was added to a mirrored page."""
+        page = self.get_page_by_id(page_id)
+        if page is not None:
+            with self.db:
+                self.db.execute(
+                    "UPDATE pages SET labels = ? WHERE id = ?",
+                    (json.dumps(sorted(set(page["labels"]) | {label})), page_id),
+                )
+
+    @staticmethod
+    def _to_page(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        """Convert a row to the shape of Confluence API page information."""
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "type": "page",
+            "title": row["title"],
+            "space": row["space"],
+            "version": {"number": row["version"]},
+            "body": {"storage": {"value": row["body"], "representation": "storage"}},
+            "labels": json.loads(row["labels"]),
+            "ancestors": json.loads(row["ancestors"]),
+        }
+
+    def get_page_by_id(self, page_id: str) -> Optional[Dict[str, Any]]:
+        """Get mirrored page information by ID, if available."""
+        return self._to_page(
+            self.db.execute(
+                "SELECT * FROM pages WHERE id = ?", (str(page_id), )
+            ).fetchone()
+        )
+
+    def get_page_by_title(self, space: str, title: str) -> Optional[Dict[str, Any]]:
+        """Get mirrored page information by title, if available."""
+        return self._to_page(
+            self.db.execute(
+                "SELECT * FROM pages WHERE space = ? AND title = ?", (space, title)
+            ).fetchone()
+        )
+
+
+class MirroredConfluence:
+    """
+    An ``atlassian.Confluence`` client that reads pages from a mirror.
+
+    Pages in the mirror are returned without contacting Confluence.  Other
+    lookups go to Confluence, as do all writes - which are also recorded in
+    the mirror.  Any other attribute is that of the wrapped client.
+
+    Parameters
+    ----------
+    client : atlassian.Confluence
+        The client to wrap.
+
+    mirror : ConfluenceMirror
+        The (already-synced) mirror.
+    """
+
+    def __init__(self, client, mirror: ConfluenceMirror):
+        self.client = client
+        self.mirror = mirror
+
+    def __getattr__(self, attr):
+        return getattr(self.client, attr)
+
+    def __repr__(self):
+        return f"<MirroredConfluence {self.client.url} {self.mirror}>"
+
+    def get_page_by_title(self, space: str, title: str, *args, **kwargs):
+        page = self.mirror.get_page_by_title(space, title)
+        if page is not None:
+            return page
+        return self.client.get_page_by_title(space, title, *args, **kwargs)
+
+    def get_page_labels(self, page_id: str, *args, **kwargs):
+        page = self.mirror.get_page_by_id(page_id)
+        if page is not None:
+            return {
+                "results": [
+                    {"prefix": "global", "name": label} for label in page["labels"]
+                ]
+            }
+        return self.client.get_page_labels(page_id, *args, **kwargs)
+
+    def get_parent_content_id(self, page_id: str):
+        page = self.mirror.get_page_by_id(page_id)
+        if page is not None and page["ancestors"]:
+            return page["ancestors"][-1]
+        return self.client.get_parent_content_id(page_id)
+
+    def set_page_label(self, page_id: str, label: str):
+        result = self.client.set_page_label(page_id, label)
+        self.mirror.add_label(page_id, label)
+        return result
+
+    def update_or_create(self, parent_id, title, body, *args, **kwargs):
+        page_info = self.client.update_or_create(
+            parent_id, title, body, *args, **kwargs
+        )
+        if page_info:
+            parent = self.mirror.get_page_by_id(parent_id)
+            self.mirror.store_page(
+                dict(page_info, ancestors=(
+                    [{"id": ancestor} for ancestor in parent["ancestors"]]
+                    if parent is not None else []
+                ) + [{"id": parent_id}]),
+                space=parent["space"] if parent is not None else None,
+                body=body,
+            )
+        return page_info
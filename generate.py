@@ -1,25 +1,28 @@
 from __future__ import annotations
 
+import argparse
+import bisect
+import collections
 import difflib
 import html
 import inspect
 import json
 import logging
+import multiprocessing
 import os
 import pathlib
 import sys
-from typing import List, Optional, Tuple
+import time
+from typing import (TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Set,
+                    Tuple, Union)
 
 import jinja2
-import numpydoc
-import numpydoc.docscrape
-import pcdsutils.utils
-import requests
-import requests.exceptions
 
-from atlassian import Confluence
+from confluence_mirror import ConfluenceMirror, MirroredConfluence
 
-logging.basicConfig(level="INFO")
+if TYPE_CHECKING:
+    # These are slow to import; the functions that need them import them
+    from atlassian import Confluence
 
 logger = logging.getLogger(__name__)
 logger.setLevel("DEBUG")
@@ -28,7 +31,11 @@ CONFLUENCE_URL = (
     os.environ.get("CONFLUENCE_URL", "") or
     "https://confluence.slac.stanford.edu"
 )
-CONFLUENCE_TOKEN = os.environ["CONFLUENCE_TOKEN"]
+# Development defaults; ``--production`` switches to the PCDS space:
+SPACE = "~klauer"
+DOCUMENTATION_ROOT_TITLE = "Typhos Documentation Root"
+PRODUCTION_SPACE = "PCDS"
+PRODUCTION_DOCUMENTATION_ROOT_TITLE = "Happi Devices"
 PAGE_TITLE_MARKER = " (Happi)"
 USER_PAGE_SUFFIX = " - Notes"
 RELATED_TITLE_SKIPS = (
@@ -40,6 +47,24 @@ HAPPI_TO_CONFLUENCE_LABEL = "happi-to-confluence"
 NO_OVERWRITE_LABEL = "no-overwrite"
 SOURCE_PATH = pathlib.Path("source")
 DIFF_IGNORE_CONFLUENCE_TAGS = True
+# Split large views into one child page per group (e.g., per hutch):
+PAGINATE_VIEWS = True
+# Groups with more PVs than this are split over several pages:
+MAX_PVS_PER_PAGE = 2000
+# What was published for each device in each space, used to prioritize the
+# next run:
+PUBLISH_RECORD_PATH = pathlib.Path("publish_record.json")
+# Local mirror of generated pages, synced with changes since the last run:
+MIRROR_PATH = pathlib.Path("confluence_mirror.sqlite")
+# Queued page updates are published after rendering this many devices:
+PUBLISH_BATCH_SIZE = 25
+# ... except for these pages shared by several devices, published at the end:
+SHARED_DEVICE_TEMPLATES = {"class.template"}
+# Device classes are imported and inspected in worker processes ahead of time.
+# Give up on a class after this many seconds:
+CLASS_INTROSPECTION_TIMEOUT = 60.0
+# Number of worker processes (None: one per CPU core):
+CLASS_INTROSPECTION_WORKERS: Optional[int] = None
 
 PageHierarchy = dict
 # TODO: annotation needs some work
@@ -74,29 +99,59 @@ class NamedTemplate:
     There may be multiple titles provided; the first valid one will be used.
     Labels will be applied to the generated page by name.
 
+    The template file is read and compiled on first use (see ``load``).
+
     Parameters
     ----------
     fn : str
         The template filename.
     """
     filename: str
-    titles: List[jinja2.Template]
-    template: jinja2.Template
-    labels: List[str]
+    _titles: Optional[List[jinja2.Template]]
+    _template: Optional[jinja2.Template]
+    _labels: Optional[List[str]]
 
     def __init__(self, fn: str):
-        with open(fn, "rt") as fp:
+        self.filename = fn
+        self._titles = None
+        self._template = None
+        self._labels = None
+
+    def load(self) -> NamedTemplate:
+        """Read and compile the template, if not already done."""
+        if self._template is not None:
+            return self
+
+        with open(self.filename, "rt") as fp:
             contents = fp.read().splitlines()
         info, contents = self._split_title_and_contents(contents)
-        self.filename = fn
-        self.labels = list(sorted(set(info["labels"]) | {HAPPI_TO_CONFLUENCE_LABEL}))
-        self.titles = [jinja2.Template(title) for title in info["title_lines"]]
-        self.template = jinja2.Template(contents)
+        titles = [jinja2.Template(title) for title in info["title_lines"]]
+        if not titles:
+            raise ValueError(f"Template invalid: {self.filename} has no filename lines")
+
+        template = jinja2.Template(contents)
         for func in JINJA_FILTERS:
-            self.template.environment.filters[func.__name__] = func
+            template.environment.filters[func.__name__] = func
 
-        if not self.titles:
-            raise ValueError(f"Template invalid: {fn} has no filename lines")
+        self._labels = list(sorted(set(info["labels"]) | {HAPPI_TO_CONFLUENCE_LABEL}))
+        self._titles = titles
+        self._template = template
+        return self
+
+    @property
+    def titles(self) -> List[jinja2.Template]:
+        """Jinja templates for each potential page title."""
+        return self.load()._titles
+
+    @property
+    def template(self) -> jinja2.Template:
+        """The Jinja template of the page contents."""
+        return self.load()._template
+
+    @property
+    def labels(self) -> List[str]:
+        """Labels to apply to the page."""
+        return self.load()._labels
 
     @staticmethod
     def _split_title_and_contents(contents) -> Tuple[dict, str]:
@@ -168,10 +223,27 @@ MATCHING_NAME_AND_CLASS_HIERARCHY: PageHierarchy = {
 
 # Additionally, "views" of all (or subsets of devices) will be generated
 # with the following.  These go at the documentation root.
+# Templates with a "group_by" option render one page per unique value of
+# that happi key, and are only generated when ``PAGINATE_VIEWS`` is set.
+# With "max_pvs_per_page", groups are further split by their number of PVs
+# (see ``split_pv_pages``).
 VIEWS: PageHierarchy = {
     NamedTemplate("all_devices.template"): {
         NamedTemplate("all_devices_by_hutch.template"): {
-        }
+            NamedTemplate("hutch_devices.template"): {
+                "_options": {
+                    "group_by": "beamline",
+                },
+            },
+        },
+        NamedTemplate("all_pvs.template"): {
+            NamedTemplate("hutch_pvs.template"): {
+                "_options": {
+                    "group_by": "beamline",
+                    "max_pvs_per_page": MAX_PVS_PER_PAGE,
+                },
+            },
+        },
     },
 }
 
@@ -179,7 +251,7 @@ docstring_template = NamedTemplate("docstring.template")
 
 
 def create_client(
-    url: str = CONFLUENCE_URL, token: str = CONFLUENCE_TOKEN
+    url: str = CONFLUENCE_URL, token: Optional[str] = None
 ) -> Confluence:
     """Create the Confluence client.
 
@@ -188,9 +260,18 @@ def create_client(
     url : str
         The confluence URL.
 
-    token : str
-        The token with read/write permissions.
+    token : str, optional
+        The token with read/write permissions.  Defaults to the
+        ``CONFLUENCE_TOKEN`` environment variable.
     """
+    import requests
+    from atlassian import Confluence
+
+    if token is None:
+        token = os.environ.get("CONFLUENCE_TOKEN", "")
+    if not token:
+        raise RuntimeError("CONFLUENCE_TOKEN must be set to talk to Confluence")
+
     s = requests.Session()
     s.headers["Authorization"] = f"Bearer {token}"
     return Confluence(url, session=s)
@@ -233,13 +314,13 @@ def best_effort_get_args(cls, happi_item):
 
     Parameters
     ----------
-    cls : type
-        The device class.
+    cls : type or inspect.Signature
+        The device class, or its signature.
 
     happi_item : dict
         Happi item metadata.
     """
-    sig = inspect.signature(cls)
+    sig = cls if isinstance(cls, inspect.Signature) else inspect.signature(cls)
     kwargs = {
         param.name: param.default
         for param in sig.parameters.values()
@@ -267,7 +348,336 @@ def best_effort_get_args(cls, happi_item):
     return kwargs
 
 
-def get_per_item_render_kwargs(client, happi_item_name, happi_item, state):
+def _plain_docstring_sections(sections: dict) -> dict:
+    """Replace numpydoc Parameters in parsed docstring sections with dicts."""
+    import numpydoc.docscrape
+
+    return {
+        section: (
+            [
+                dict(name=item.name, type=item.type, desc=list(item.desc))
+                if isinstance(item, numpydoc.docscrape.Parameter) else item
+                for item in items
+            ]
+            if isinstance(items, list) else items
+        )
+        for section, items in sections.items()
+    }
+
+
+def introspect_device_class(device_class_name: str) -> dict:
+    """
+    Import a device class and gather what the pages need to know about it.
+
+    This is intended to be run in a worker process (see
+    ``introspect_device_classes``), as some classes are slow to import, have
+    side effects, or may even hang.
+
+    Parameters
+    ----------
+    device_class_name : str
+        The fully-qualified device class name from happi.
+
+    Returns
+    -------
+    info : dict
+        Picklable information about the class.
+        name: the class name
+        doc: the class docstring, or "None"
+        sections: the numpydoc-parsed docstring sections
+        parameters: the signature parameters as (name, kind, default) or None
+        error: the reason for failure, or None
+    """
+    import numpydoc.docscrape
+    import pcdsutils.utils
+
+    info = {
+        "name": device_class_name.split(".")[-1],
+        "doc": "None",
+        "sections": {},
+        "parameters": None,
+        "error": None,
+    }
+    try:
+        cls = pcdsutils.utils.import_helper(device_class_name)
+    except Exception as ex:
+        info["error"] = f"Import failed: {ex.__class__.__name__}: {ex}"
+    else:
+        info["name"] = cls.__name__
+        info["doc"] = inspect.getdoc(cls) or "None"
+        try:
+            info["parameters"] = [
+                (
+                    param.name,
+                    param.kind.name,
+                    None if param.default is param.empty else str(param.default),
+                )
+                for param in inspect.signature(cls).parameters.values()
+            ]
+        except Exception as ex:
+            info["error"] = f"No signature: {ex.__class__.__name__}: {ex}"
+
+    info["sections"] = _plain_docstring_sections(
+        dict(numpydoc.docscrape.NumpyDocString(info["doc"]))
+    )
+    return info
+
+
+def _failed_introspection(device_class_name: str, error: str) -> dict:
+    """Introspection information for a class that could not be inspected."""
+    return {
+        "name": device_class_name.split(".")[-1],
+        "doc": "None",
+        "sections": {},
+        "parameters": None,
+        "error": error,
+    }
+
+
+def signature_from_introspection(info: dict) -> Optional[inspect.Signature]:
+    """Rebuild the class signature from ``introspect_device_class`` info."""
+    if info["parameters"] is None:
+        return None
+    return inspect.Signature([
+        inspect.Parameter(
+            name,
+            getattr(inspect.Parameter, kind),
+            **({} if default is None else {"default": default}),
+        )
+        for name, kind, default in info["parameters"]
+    ])
+
+
+def introspect_device_classes(
+    device_class_names,
+    timeout: float = CLASS_INTROSPECTION_TIMEOUT,
+    processes: Optional[int] = CLASS_INTROSPECTION_WORKERS,
+) -> Dict[str, dict]:
+    """
+    Introspect many device classes in parallel worker processes.
+
+    Each class gets ``timeout`` seconds from when its worker picks it up.
+    A class that fails to import, crashes its worker, or takes too long gets
+    placeholder information instead, so that it cannot stall the run.
+
+    Parameters
+    ----------
+    device_class_names : iterable of str
+        Fully-qualified device class names.
+
+    timeout : float, optional
+        Per-class timeout, in seconds.
+
+    processes : int, optional
+        Number of worker processes.  Defaults to the number of CPU cores.
+
+    Returns
+    -------
+    dict
+        Device class name to ``introspect_device_class`` information.
+    """
+    pending = sorted(set(device_class_names))
+    processes = min(processes or os.cpu_count() or 1, max(len(pending), 1))
+    results = {}
+    t0 = time.monotonic()
+    while pending:
+        pool = multiprocessing.Pool(processes)
+        # Only as many classes are handed out as there are free workers, so
+        # that each timeout starts when the class does.  A worker that times
+        # out may be stuck forever, so its slot is not used again.
+        slots = processes
+        in_flight = {}
+        try:
+            while (pending or in_flight) and slots > 0:
+                while pending and len(in_flight) < slots:
+                    name = pending.pop(0)
+                    in_flight[name] = (
+                        pool.apply_async(introspect_device_class, (name, )),
+                        time.monotonic() + timeout,
+                    )
+
+                time.sleep(0.01)
+                for name, (result, deadline) in list(in_flight.items()):
+                    if result.ready():
+                        try:
+                            results[name] = result.get()
+                        except Exception as ex:
+                            results[name] = _failed_introspection(
+                                name, f"Worker failed: {ex.__class__.__name__}: {ex}"
+                            )
+                    elif time.monotonic() > deadline:
+                        logger.warning(
+                            "Timed out introspecting %s after %.1f sec",
+                            name, timeout,
+                        )
+                        results[name] = _failed_introspection(
+                            name, f"Timed out after {timeout} sec"
+                        )
+                        slots -= 1
+                    else:
+                        continue
+                    del in_flight[name]
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # If every worker got stuck, start over with a fresh pool:
+        pending = list(in_flight) + pending
+
+    logger.info(
+        "Introspected %d device classes in %.1f sec (%d failed)",
+        len(results), time.monotonic() - t0,
+        sum(1 for info in results.values() if info["error"]),
+    )
+    return results
+
+
+PVIndexRow = collections.namedtuple(
+    "PVIndexRow", ["name", "device", "kind", "record"]
+)
+
+
+class PVIndex:
+    """
+    An index of every PV used by happi items, from whatrecord records.
+
+    The index is stored column-wise, sorted once by (device, kind, PV name),
+    so that the PVs of a device - grouped by kind - are slices of the
+    columns.  A second ordering by PV name backs PV to device lookups.
+
+    Parameters
+    ----------
+    devices : list of str
+        The happi item name for each row.
+
+    kinds : list of str
+        The ophyd kind for each row (e.g., "hinted" or "normal").
+
+    names : list of str
+        The PV name for each row.
+
+    records : list of dict
+        The whatrecord record information for each row.
+    """
+    devices: List[str]
+    kinds: List[str]
+    names: List[str]
+    records: List[dict]
+
+    def __init__(
+        self,
+        devices: List[str],
+        kinds: List[str],
+        names: List[str],
+        records: List[dict],
+    ):
+        self.devices = devices
+        self.kinds = kinds
+        self.names = names
+        self.records = records
+        # device -> kind -> (start, stop)
+        self._slices: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        start = 0
+        for idx in range(1, len(names) + 1):
+            if (
+                idx == len(names) or
+                (devices[idx], kinds[idx]) != (devices[start], kinds[start])
+            ):
+                self._slices.setdefault(devices[start], {})[kinds[start]] = (
+                    start, idx
+                )
+                start = idx
+
+        self._by_name = sorted(range(len(names)), key=names.__getitem__)
+        self._sorted_names = [names[idx] for idx in self._by_name]
+
+    @classmethod
+    def from_happi_items(cls, md_by_key: Dict[str, dict]) -> PVIndex:
+        """Build the index from happi item name to happi item metadata."""
+        rows = [
+            (happi_name, record["kind"].replace("Kind.", ""), record["name"], record)
+            for happi_name, happi_item in md_by_key.items()
+            for record in happi_item.get("_whatrecord", {}).get("records", None) or []
+        ]
+        rows.sort(key=lambda row: row[:3])
+        columns = [list(column) for column in zip(*rows)] or [[], [], [], []]
+        return cls(*columns)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __repr__(self):
+        return f"<PVIndex {len(self)} PVs of {len(self._slices)} devices>"
+
+    def row(self, idx: int) -> PVIndexRow:
+        """Get a single row of the index."""
+        return PVIndexRow(
+            self.names[idx], self.devices[idx], self.kinds[idx], self.records[idx]
+        )
+
+    def rows_by_name(self) -> Iterator[PVIndexRow]:
+        """All rows, sorted by PV name."""
+        for idx in self._by_name:
+            yield self.row(idx)
+
+    def device_count(self, device: str) -> int:
+        """The number of PVs of the given happi item."""
+        return sum(
+            stop - start for start, stop in self._slices.get(device, {}).values()
+        )
+
+    def device_rows(self, device: str) -> List[PVIndexRow]:
+        """All rows for the given happi item, sorted by kind and PV name."""
+        slices = self._slices.get(device, {})
+        if not slices:
+            return []
+        start = min(start for start, _ in slices.values())
+        stop = max(stop for _, stop in slices.values())
+        return [self.row(idx) for idx in range(start, stop)]
+
+    def lookup(self, pv_name: str) -> List[PVIndexRow]:
+        """Find all devices that use ``pv_name``."""
+        start = bisect.bisect_left(self._sorted_names, pv_name)
+        stop = bisect.bisect_right(self._sorted_names, pv_name, lo=start)
+        return [self.row(idx) for idx in self._by_name[start:stop]]
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> List[PVIndexRow]:
+        """Find all rows with a PV name starting with ``prefix``."""
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        stop = start
+        while (
+            stop < len(self._sorted_names) and
+            self._sorted_names[stop].startswith(prefix) and
+            (limit is None or stop - start < limit)
+        ):
+            stop += 1
+        return [self.row(idx) for idx in self._by_name[start:stop]]
+
+    def pvs_by_kind(self, device: str) -> Dict[str, List[dict]]:
+        """
+        The records of a happi item, grouped by kind and sorted by PV name.
+
+        "hinted" and "normal" come first (and are present even if empty),
+        followed by the other kinds in order of their first PV name.
+        """
+        slices = self._slices.get(device, {})
+        if not slices:
+            return {}
+
+        other_kinds = sorted(
+            (kind for kind in slices if kind not in ("hinted", "normal")),
+            key=lambda kind: self.names[slices[kind][0]],
+        )
+        pvs_by_kind = {}
+        for kind in ["hinted", "normal"] + other_kinds:
+            start, stop = slices.get(kind, (0, 0))
+            pvs_by_kind[kind] = self.records[start:stop]
+        return pvs_by_kind
+
+
+def get_per_item_render_kwargs(
+    client, happi_item_name, happi_item, state, class_info=None
+):
     """
     For a given happi item, return render kwargs for a template.
 
@@ -283,7 +693,12 @@ def get_per_item_render_kwargs(client, happi_item_name, happi_item, state):
         The happi item metadata dictionary.
 
     state : dict
-        The current happi-to-confluence render state.
+        The current happi-to-confluence render state.  If available, PVs are
+        taken from its ``PVIndex`` (``state["_pv_index"]``).
+
+    class_info : dict, optional
+        The ``introspect_device_class`` information for the device class.
+        If not provided, the class is introspected in this process.
 
     Returns
     -------
@@ -302,21 +717,18 @@ def get_per_item_render_kwargs(client, happi_item_name, happi_item, state):
         item_state: this device's state from happi-to-confluence
         confluence_url: the base confluence URL (``CONFLUENCE_URL``)
     """
-    device_class_name = happi_item["device_class"]
-    try:
-        cls = pcdsutils.utils.import_helper(device_class_name)
-    except Exception:
-        device_class_doc = "None"
-        device_class_name = device_class_name.split(".")[-1]
-        cls = None
+    if class_info is None:
+        class_info = introspect_device_class(happi_item["device_class"])
+
+    device_class_name = class_info["name"]
+    signature = signature_from_introspection(class_info)
+    if signature is None:
         kwargs = {}
     else:
-        device_class_doc = inspect.getdoc(cls) or "None"
-        device_class_name = cls.__name__
-        kwargs = best_effort_get_args(cls, happi_item)
+        kwargs = best_effort_get_args(signature, happi_item)
 
     _, rendered_docstring = docstring_template.render(
-        sections=dict(numpydoc.docscrape.NumpyDocString(device_class_doc)),
+        sections=class_info["sections"],
         kwargs=kwargs,
         happi_item=happi_item,
     )
@@ -349,17 +761,10 @@ def get_per_item_render_kwargs(client, happi_item_name, happi_item, state):
             "Found %d related pages for %s", len(related_pages), happi_item_name
         )
 
-    relevant_pvs = happi_item.get("_whatrecord", {}).get("records", [])
-    if not relevant_pvs:
-        pvs_by_kind = {}
-    else:
-        pvs_by_kind = {
-            "hinted": [],
-            "normal": [],
-        }
-        for pv in sorted(relevant_pvs, key=lambda pv: pv["name"]):
-            kind = pv["kind"].replace("Kind.", "")
-            pvs_by_kind.setdefault(kind, []).append(pv)
+    pv_index = state.get("_pv_index", None)
+    if pv_index is None:
+        pv_index = PVIndex.from_happi_items({happi_item_name: happi_item})
+    pvs_by_kind = pv_index.pvs_by_kind(happi_item_name)
 
     return dict(
         identifier=happi_item_name,
@@ -389,8 +794,8 @@ def split_by_key(
     for _, md in states.items():
         try:
             happi_md = md["happi_item"]
-        except KeyError:
-            # May be _related_pages or something
+        except (KeyError, TypeError):
+            # May be _related_pages, _pv_index or something
             continue
 
         section = happi_md.get(key, None)
@@ -409,6 +814,38 @@ def split_by_key(
     return results
 
 
+def split_pv_pages(
+    groups: Dict[str, List[dict]],
+    pv_index: PVIndex,
+    max_pvs: int,
+) -> Dict[str, List[dict]]:
+    """
+    Split groups of item states into pages of at most ``max_pvs`` PVs.
+
+    A device is never split over pages, so a page may go over ``max_pvs``
+    if a single device has more than that.  Groups that need more than one
+    page are named ``{group} ({part})``.
+    """
+    pages = {}
+    for group, items in sorted(groups.items()):
+        parts = [[]]
+        num_pvs = 0
+        for info in items:
+            count = pv_index.device_count(info["happi_item"]["name"])
+            if parts[-1] and num_pvs + count > max_pvs:
+                parts.append([])
+                num_pvs = 0
+            parts[-1].append(info)
+            num_pvs += count
+
+        if len(parts) == 1:
+            pages[group] = parts[0]
+        else:
+            for part, part_items in enumerate(parts, 1):
+                pages[f"{group} ({part})"] = part_items
+    return pages
+
+
 def get_view_render_kwargs(view, view_state, all_item_state):
     """
     Get aggregate view render keyword arguments.
@@ -420,12 +857,24 @@ def get_view_render_kwargs(view, view_state, all_item_state):
         identifier: the page identifier is just the view name itself
         all_item_state: the state after generating all device pages
         view_state: the state information while generating aggregate views
+        paginated: views are split into per-group child pages
+        pv_index: the ``PVIndex`` of all PVs
+        pv_pages_by_beamline: the PV pages of each beamline (``split_pv_pages``)
     """
+    all_item_state_by_beamline = split_by_key(
+        all_item_state, key="beamline", include_none=True
+    )
+    pv_index = all_item_state.get("_pv_index", None) or PVIndex.from_happi_items({})
     return dict(
         identifier=view.filename,
         all_item_state=all_item_state,
-        all_item_state_by_beamline=split_by_key(all_item_state, key="beamline"),
+        all_item_state_by_beamline=all_item_state_by_beamline,
         view_state=view_state,
+        paginated=PAGINATE_VIEWS,
+        pv_index=pv_index,
+        pv_pages_by_beamline=split_pv_pages(
+            all_item_state_by_beamline, pv_index, MAX_PVS_PER_PAGE
+        ),
         root_page=DOCUMENTATION_ROOT_TITLE,
         page_title_marker=PAGE_TITLE_MARKER,
         user_page_suffix=USER_PAGE_SUFFIX,
@@ -529,6 +978,168 @@ def diff_pages(
     return diff_string
 
 
+class PublishQueue:
+    """
+    A Confluence client wrapper that coalesces page writes within a run.
+
+    Updates to existing pages and their new labels are held until ``flush``,
+    so that a page written several times before then is uploaded once - with
+    the final body and all of the labels - rather than creating a new version
+    (and notifying watchers) for each write.  ``flush`` may be limited to
+    certain pages, so that others (e.g., those shared by many devices) keep
+    being coalesced until the end of the run.  New pages are created and
+    labeled right away, as their IDs are needed for child pages and an
+    unlabeled page would not be recognized as ours by the next run.
+
+    Reads reflect the pending writes.  Any other attribute is that of the
+    wrapped client.
+
+    Parameters
+    ----------
+    client : atlassian.Confluence
+        The client to wrap.
+
+    space : str
+        The Confluence space being published to.
+    """
+    client: Confluence
+    space: str
+    #: Page ID to update_or_create keyword arguments of the final write
+    pending_updates: Dict[str, dict]
+    #: Page ID to labels to add
+    pending_labels: Dict[str, Set[str]]
+    #: IDs of pages created in this run
+    created: Set[str]
+
+    def __init__(self, client: Confluence, space: str):
+        self.client = client
+        self.space = space
+        self.pending_updates = {}
+        self.pending_labels = {}
+        self.created = set()
+        self._coalesced = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.client, attr)
+
+    def __repr__(self):
+        return (
+            f"<PublishQueue {len(self.pending_updates)} updates "
+            f"{sum(len(labels) for labels in self.pending_labels.values())} labels>"
+        )
+
+    def get_page_by_title(self, space: str, title: str, *args, **kwargs):
+        page = self.client.get_page_by_title(space, title, *args, **kwargs)
+        if page is not None and str(page["id"]) in self.pending_updates:
+            pending = self.pending_updates[str(page["id"])]
+            page = dict(
+                page,
+                body={
+                    "storage": {
+                        "value": pending["body"],
+                        "representation": "storage",
+                    },
+                },
+            )
+        return page
+
+    def get_page_labels(self, page_id: str, *args, **kwargs):
+        labels = self.client.get_page_labels(page_id, *args, **kwargs)
+        existing = {label["name"] for label in labels["results"]}
+        pending = self.pending_labels.get(str(page_id), set()) - existing
+        if pending:
+            labels = dict(
+                labels,
+                results=labels["results"] + [
+                    {"prefix": "global", "name": label} for label in sorted(pending)
+                ],
+            )
+        return labels
+
+    def set_page_label(self, page_id: str, label: str) -> None:
+        if str(page_id) in self.created:
+            self.client.set_page_label(page_id, label)
+        else:
+            self.pending_labels.setdefault(str(page_id), set()).add(label)
+
+    def update_or_create(self, parent_id, title: str, body: str, **kwargs) -> dict:
+        existing = self.client.get_page_by_title(space=self.space, title=title)
+        if existing is None:
+            page_info = self.client.update_or_create(
+                parent_id=parent_id, title=title, body=body, **kwargs
+            )
+            self.created.add(str(page_info["id"]))
+            return page_info
+
+        page_id = str(existing["id"])
+        if page_id in self.pending_updates:
+            logger.info("Coalescing updates to page %r (%s)", title, page_id)
+            self._coalesced += 1
+        self.pending_updates[page_id] = dict(
+            kwargs, parent_id=parent_id, title=title, body=body
+        )
+        return dict(existing, title=title)
+
+    def flush(self, page_ids: Optional[Iterable[str]] = None) -> Set[str]:
+        """
+        Write pending page updates and labels to Confluence.
+
+        Parameters
+        ----------
+        page_ids : iterable of str, optional
+            Only write the updates and labels of these pages.  Defaults to
+            all pages.
+
+        Returns
+        -------
+        failed : set of str
+            The IDs of pages that could not be updated or labeled.
+        """
+        if page_ids is None:
+            pending_updates, self.pending_updates = self.pending_updates, {}
+            pending_labels, self.pending_labels = self.pending_labels, {}
+            self._coalesced = 0
+        else:
+            page_ids = {str(page_id) for page_id in page_ids}
+            pending_updates = {
+                page_id: self.pending_updates.pop(page_id)
+                for page_id in page_ids & set(self.pending_updates)
+            }
+            pending_labels = {
+                page_id: self.pending_labels.pop(page_id)
+                for page_id in page_ids & set(self.pending_labels)
+            }
+
+        logger.info(
+            "Publishing %d page updates and labels for %d pages (%d coalesced "
+            "updates so far)", len(pending_updates), len(pending_labels),
+            self._coalesced,
+        )
+
+        failed = set()
+        for page_id, update_kw in pending_updates.items():
+            title = update_kw["title"]
+            try:
+                self.client.update_or_create(**update_kw)
+            except Exception as ex:
+                logger.error("Failed to update page: %s", ex, exc_info=True)
+                with open(f"failed_update_{title}.txt", "wt") as fp:
+                    fp.write(update_kw["body"])
+                failed.add(page_id)
+
+        for page_id, labels in pending_labels.items():
+            for label in sorted(labels):
+                try:
+                    self.client.set_page_label(page_id, label)
+                except Exception as ex:
+                    logger.error(
+                        "Failed to set label %s on page %s: %s", label, page_id, ex,
+                        exc_info=True
+                    )
+                    failed.add(page_id)
+        return failed
+
+
 def render_pages(
     client: Confluence,
     page_to_children: PageHierarchy,
@@ -566,9 +1177,23 @@ def render_pages(
     for page_template, children in page_to_children.items():
         if not isinstance(page_template, NamedTemplate):
             continue
-        logger.info("Rendering %s", page_template.filename)
 
         options = children.get("_options", {})
+        if "group_by" in options:
+            if render_kw.get("paginated", False):
+                render_grouped_pages(
+                    client,
+                    page_template,
+                    children,
+                    parent=parent,
+                    space=space,
+                    render_kw=render_kw,
+                    state=state,
+                    minor_edit=minor_edit,
+                )
+            continue
+
+        logger.info("Rendering %s", page_template.filename)
         titles, new_source = page_template.render(**render_kw)
         existing_page = None
         existing_labels = {}
@@ -683,6 +1308,115 @@ def render_pages(
     return state
 
 
+def render_grouped_pages(
+    client: Confluence,
+    page_template: NamedTemplate,
+    children: PageHierarchy,
+    parent: dict,
+    space: str,
+    render_kw: dict,
+    state: dict,
+    minor_edit: bool = True,
+):
+    """
+    Render one page per group of happi items for a paginated view.
+
+    Items are grouped by the happi key in the ``group_by`` option, and
+    split further by their number of PVs with the ``max_pvs_per_page``
+    option.  Each group page is diffed and published independently, so only
+    the groups that actually changed get re-uploaded.
+
+    Parameters
+    ----------
+    client : atlassian.Confluence
+        The pre-configured Confluence client.
+
+    page_template : NamedTemplate
+        The template to render for each group.
+
+    children : PageHierarchy
+        The options and child pages of ``page_template``.
+
+    parent : dict
+        Parent page information from ``get_page_by_title``.
+
+    space : str
+        The Confluence space to publish to.
+
+    render_kw : dict
+        Render keyword arguments of the view.  Each group page additionally
+        gets ``group`` (the group name) and ``group_items`` (its item states).
+
+    state : dict
+        The view state, keyed by ``{identifier}/{group}`` for each group.
+    """
+    options = dict(children["_options"])
+    group_by = options.pop("group_by")
+    max_pvs_per_page = options.pop("max_pvs_per_page", None)
+    per_group_hierarchy = {
+        page_template: dict(children, _options=options),
+    }
+    # Items without the key get their own group, so every item is listed
+    groups = split_by_key(
+        render_kw["all_item_state"], key=group_by, include_none=True
+    )
+    if max_pvs_per_page is not None:
+        groups = split_pv_pages(groups, render_kw["pv_index"], max_pvs_per_page)
+    for group, group_items in sorted(groups.items()):
+        render_pages(
+            client,
+            per_group_hierarchy,
+            parent=parent,
+            space=space,
+            render_kw=dict(
+                render_kw,
+                identifier=f"{render_kw['identifier']}/{group}",
+                group=group,
+                group_items=group_items,
+            ),
+            state=state,
+            properties={},
+            minor_edit=minor_edit,
+        )
+
+    log_orphaned_pages(client, parent, state)
+
+
+def log_orphaned_pages(client: Confluence, parent: dict, state: dict) -> None:
+    """
+    Warn about generated child pages of ``parent`` not rendered in this run.
+
+    These are left behind when a group (e.g., a hutch) no longer has any
+    items, and nothing links to them any longer.
+    """
+    rendered_ids = {
+        str(page_info["id"])
+        for identifier_state in state.values()
+        if isinstance(identifier_state, dict)
+        for page_info in identifier_state.values()
+        if isinstance(page_info, dict) and "id" in page_info
+    }
+    query = (
+        f'parent = {parent["id"]} and type = page '
+        f'and label = "{HAPPI_TO_CONFLUENCE_LABEL}"'
+    )
+    try:
+        children = client.cql(query, limit=500).get("results", [])
+    except Exception:
+        logger.warning("Failed to list child pages of %s", parent["title"], exc_info=True)
+        return
+
+    for child in children:
+        content = child["content"]
+        if str(content["id"]) not in rendered_ids:
+            logger.warning(
+                "Generated page %r (%s) under %r was not updated in this run; "
+                "it may be for a group that no longer exists and should be "
+                "removed by hand.",
+                content["title"], content["id"], parent["title"],
+            )
+
+
 def initialize_client(space: str, root_title: str) -> Tuple[Confluence, dict]:
     """
     Initialize the Confluence client.
@@ -707,13 +1441,204 @@ def initialize_client(space: str, root_title: str) -> Tuple[Confluence, dict]:
     return client, root_page
 
 
+def _load_all_publish_records(path: pathlib.Path) -> Dict[str, dict]:
+    """Load the publish records of all spaces, keyed by space."""
+    try:
+        with open(path, "rt") as fp:
+            return json.load(fp).get("spaces", {})
+    except FileNotFoundError:
+        ...
+    except Exception:
+        logger.warning("Failed to load publish record %s", path, exc_info=True)
+    return {}
+
+
+def load_publish_record(
+    space: str, path: pathlib.Path = PUBLISH_RECORD_PATH
+) -> dict:
+    """
+    Load the record of what was published to ``space`` by previous runs.
+
+    Parameters
+    ----------
+    space : str
+        The Confluence space.
+
+    path : pathlib.Path
+        The publish record JSON filename, shared by all spaces.
+
+    Returns
+    -------
+    record : dict
+        record["devices"][happi_name] -> {"last_edit": ..., "device_class": ...,
+                                          "published": ..., "pages": ...}
+        record["last_run"] -> information about where the last run stopped
+    """
+    record = _load_all_publish_records(path).get(space, {})
+    record.setdefault("devices", {})
+    record.setdefault("last_run", {})
+    return record
+
+
+def save_publish_record(
+    space: str, record: dict, path: pathlib.Path = PUBLISH_RECORD_PATH
+) -> None:
+    """Save the record of what was published to ``space`` in ``path``."""
+    records = _load_all_publish_records(path)
+    records[space] = record
+    with open(path, "wt") as fp:
+        json.dump({"spaces": records}, fp, indent=2, sort_keys=True)
+
+
+def get_publish_key(happi_item: dict) -> Dict[str, Optional[str]]:
+    """The happi item information that indicates its pages need updating."""
+    return {
+        "last_edit": happi_item.get("last_edit", None),
+        "device_class": happi_item.get("device_class", None),
+    }
+
+
+PRIORITY_CHANGED = 0
+PRIORITY_NEW = 1
+PRIORITY_UNCHANGED = 2
+PRIORITY_NAMES = {
+    PRIORITY_CHANGED: "changed",
+    PRIORITY_NEW: "new",
+    PRIORITY_UNCHANGED: "unchanged",
+}
+
+
+def get_device_page_ids(item_state: dict, shared: bool = True) -> Set[str]:
+    """
+    The IDs of the pages rendered for a device.
+
+    With ``shared=False``, pages shared by several devices (those of
+    ``SHARED_DEVICE_TEMPLATES``, e.g. class pages) are left out.
+    """
+    return {
+        str(page_info["id"])
+        for filename, page_info in item_state.items()
+        if isinstance(page_info, dict) and "_template_" in page_info
+        if shared or filename not in SHARED_DEVICE_TEMPLATES
+    }
+
+
+def get_publish_entry(happi_item: dict, item_state: dict) -> dict:
+    """
+    The publish record entry of a device whose pages were just published.
+
+    Along with the ``get_publish_key``, this has the publish time and the
+    ID and title of each page, so that views may link to the device without
+    rendering it again.
+    """
+    return dict(
+        get_publish_key(happi_item),
+        published=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        pages={
+            filename: {"id": str(page_info["id"]), "title": page_info["title"]}
+            for filename, page_info in item_state.items()
+            if isinstance(page_info, dict) and "_template_" in page_info
+        },
+    )
+
+
+def get_device_priority(
+    happi_name: str, happi_item: dict, published: Dict[str, dict]
+) -> int:
+    """Get the ``PRIORITY_*`` of a happi item; lower goes first."""
+    if happi_name not in published:
+        return PRIORITY_NEW
+    key = get_publish_key(happi_item)
+    if {name: published[happi_name].get(name, None) for name in key} != key:
+        return PRIORITY_CHANGED
+    return PRIORITY_UNCHANGED
+
+
+def prioritize_devices(
+    md_by_key: Dict[str, dict],
+    published: Dict[str, dict],
+) -> List[Tuple[str, dict]]:
+    """
+    Order happi items by how likely their pages are to need an update.
+
+    Devices that were edited in happi (``last_edit``) or changed class since
+    they were last published come first, then devices that have never been
+    published, then everything else - least recently published first, so
+    that runs cut short by a time budget take turns at refreshing them.
+    The happi database order is kept otherwise.  Items without a
+    ``device_class`` are left out.
+
+    Parameters
+    ----------
+    md_by_key : dict
+        Happi item name to happi item metadata.
+
+    published : dict
+        Happi item name to ``get_publish_entry`` of its last publish.
+
+    Returns
+    -------
+    list of (happi_name, happi_item)
+    """
+    def priority(name_and_item) -> Tuple[int, str]:
+        happi_name, happi_item = name_and_item
+        priority = get_device_priority(happi_name, happi_item, published)
+        if priority != PRIORITY_UNCHANGED:
+            return priority, ""
+        return priority, published[happi_name].get("published", "")
+
+    # Items without a device class are never published
+    return sorted(
+        (
+            (happi_name, happi_item)
+            for happi_name, happi_item in md_by_key.items()
+            if happi_item.get("device_class", None)
+        ),
+        key=priority,
+    )
+
+
+def restore_device_state(
+    state: dict,
+    devices: List[Tuple[str, dict]],
+    published: Dict[str, dict],
+) -> bool:
+    """
+    Fill in ``state`` for unchanged devices from the publish record.
+
+    Devices that were not rendered in this run (as the time budget ran out)
+    may then still be listed in the view pages.
+
+    Returns
+    -------
+    bool
+        True if the state of every one of ``devices`` was restored.
+    """
+    restored_all = True
+    for happi_name, happi_item in devices:
+        pages = published.get(happi_name, {}).get("pages", {})
+        if (
+            get_device_priority(happi_name, happi_item, published) != PRIORITY_UNCHANGED or
+            "device.template" not in pages
+        ):
+            restored_all = False
+            continue
+
+        item_state = state.setdefault(happi_name, {})
+        for filename, page_info in pages.items():
+            item_state[filename] = dict(page_info)
+        item_state["happi_item"] = happi_item
+    return restored_all
+
+
 def render_device_pages(
     space: str,
     client: Confluence,
     root_page,
     happi_info_filename: str = "happi_info.json",
     testing: bool = False,
-) -> dict:
+    time_budget: Optional[float] = None,
+) -> Tuple[dict, bool]:
     """
     Render all individual device pages.
 
@@ -732,61 +1657,146 @@ def render_device_pages(
         The happi info JSON filename, generated from
         ``whatrecord.plugins.happi``.
 
+    time_budget : float, optional
+        Stop cleanly after this many seconds.  Devices are worked on in order
+        of priority (see ``prioritize_devices``), so the most likely updates
+        are made first.  Queued page updates are published every
+        ``PUBLISH_BATCH_SIZE`` devices, so uploads count toward the budget;
+        a device is only recorded as published once all of its pages are.
+        Pages shared by devices (``SHARED_DEVICE_TEMPLATES``) are published
+        once, at the end.
+        Unchanged devices that were not reached are restored from the
+        publish record (see ``restore_device_state``).
+
     Returns
     -------
     state : dict
         Returns aggregated information about all generated pages.
         Includes per-device "happi_item" information and page information.
         state["_related_pages"][happi_name]
+        state["_pv_index"] -> PVIndex
         state[happi_name][page_template_filename] -> page_info
         state[happi_name][page_template_filename]["_template_"]
         state[happi_name]["happi_item"]
+
+    completed : bool
+        False if the time budget ran out before all devices were rendered,
+        unless those remaining were unchanged since their last publish.
     """
     state = {}
+    t0 = time.monotonic()
+    # Rendered devices whose queued page updates are not yet published:
+    unpublished = []
+
+    def publish_batch(final: bool = False):
+        # Shared pages are coalesced until the final batch
+        if not isinstance(client, PublishQueue):
+            failed = set()
+        elif final:
+            failed = client.flush()
+        else:
+            failed = client.flush(
+                page_id
+                for happi_name, _ in unpublished
+                for page_id in get_device_page_ids(state[happi_name], shared=False)
+            )
 
-    with open(happi_info_filename, "rt") as fp:
-        happi_info = json.load(fp)
-
-    # Keys for the happi plugin are the happi item names
-    md_by_key = happi_info["metadata_by_key"]
-    for idx, (happi_name, happi_item) in enumerate(md_by_key.items(), 1):
-        logger.info("")
-        logger.info(f"Working on device {idx} of {len(md_by_key)}: {happi_name}...")
-        if not happi_item.get("device_class", None):
-            continue
-
-        render_kw = get_per_item_render_kwargs(
-            client, happi_name, happi_item, state=state
-        )
+        for happi_name, happi_item in unpublished:
+            item_state = state[happi_name]
+            if "device.template" not in item_state:
+                continue
+            if get_device_page_ids(item_state) & failed:
+                logger.warning("Pages of %s failed to publish; retrying next run", happi_name)
+            else:
+                published[happi_name] = get_publish_entry(happi_item, item_state)
+        unpublished.clear()
+
+        if final and failed:
+            # Devices of earlier batches whose shared pages failed to publish
+            for happi_name, _ in to_process[:num_done]:
+                if (
+                    happi_name in published and
+                    get_device_page_ids(state[happi_name]) & failed
+                ):
+                    logger.warning("Pages of %s failed to publish; retrying next run", happi_name)
+                    del published[happi_name]
+
+    md_by_key = load_happi_info(happi_info_filename)
+    publish_record = load_publish_record(space)
+    published = publish_record["devices"]
+    state["_pv_index"] = PVIndex.from_happi_items(md_by_key)
+
+    to_process = prioritize_devices(md_by_key, published)
+    if testing:
+        to_process = to_process[:11]
+
+    class_info = introspect_device_classes(
+        happi_item["device_class"] for _, happi_item in to_process
+    )
 
-        if happi_name.lower() == str(render_kw["device_class"]).lower():
-            # In cases of devices like AT1K4, its class and happi name are
-            # the same; so we can't make it a subpage.. hmm
-            to_render = MATCHING_NAME_AND_CLASS_HIERARCHY
-            state[happi_name]["has_class_page"] = False
-        else:
-            to_render = PER_DEVICE_HIERARCHY
-            state[happi_name]["has_class_page"] = True
+    num_done = 0
+    try:
+        for idx, (happi_name, happi_item) in enumerate(to_process, 1):
+            elapsed = time.monotonic() - t0
+            if time_budget is not None and elapsed > time_budget:
+                logger.warning(
+                    "Time budget of %.1f sec exhausted; stopping at device %d of "
+                    "%d (%s)", time_budget, idx, len(to_process), happi_name
+                )
+                break
 
-        render_pages(
-            client=client,
-            page_to_children=to_render,
-            render_kw=render_kw,
-            parent=root_page,
-            space=SPACE,
-            state=state,
-            properties=dict(
-                device_name=happi_name,
-                # happi_item=happi_item,
-                device_class=render_kw["device_class"],
-            ),
-        )
-        state[happi_name]["happi_item"] = happi_item
+            logger.info("")
+            logger.info(f"Working on device {idx} of {len(to_process)}: {happi_name}...")
+            render_kw = get_per_item_render_kwargs(
+                client, happi_name, happi_item, state=state,
+                class_info=class_info[happi_item["device_class"]],
+            )
 
-        if testing and idx > 10:
-            break
+            if happi_name.lower() == str(render_kw["device_class"]).lower():
+                # In cases of devices like AT1K4, its class and happi name are
+                # the same; so we can't make it a subpage.. hmm
+                to_render = MATCHING_NAME_AND_CLASS_HIERARCHY
+                state[happi_name]["has_class_page"] = False
+            else:
+                to_render = PER_DEVICE_HIERARCHY
+                state[happi_name]["has_class_page"] = True
+
+            render_pages(
+                client=client,
+                page_to_children=to_render,
+                render_kw=render_kw,
+                parent=root_page,
+                space=space,
+                state=state,
+                properties=dict(
+                    device_name=happi_name,
+                    # happi_item=happi_item,
+                    device_class=render_kw["device_class"],
+                ),
+            )
+            state[happi_name]["happi_item"] = happi_item
+            unpublished.append((happi_name, happi_item))
+            num_done = idx
+            # Uploads take most of the time; publish within the time budget
+            if len(unpublished) >= PUBLISH_BATCH_SIZE:
+                publish_batch()
+    finally:
+        # Record progress even if rendering failed part of the way through
+        publish_batch(final=True)
+        remaining = [name for name, _ in to_process[num_done:]]
+        publish_record["last_run"] = {
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "elapsed": time.monotonic() - t0,
+            "completed": not remaining,
+            "stopped_at": remaining[0] if remaining else None,
+            "remaining": remaining,
+        }
+        try:
+            save_publish_record(space, publish_record)
+        except Exception:
+            logger.warning("Failed to save the publish record", exc_info=True)
 
-    return state
+    return state, restore_device_state(state, to_process[num_done:], published)
 
 
 def render_view_pages(space: str, client: Confluence, root_page, state):
@@ -823,25 +1833,166 @@ def render_view_pages(space: str, client: Confluence, root_page, state):
     return view_state
 
 
-def main(space: str, root_title: str, testing: bool = False):
+def initialize_mirror(
+    client: Confluence, space: str, full_sync: bool = False
+) -> Union[Confluence, MirroredConfluence]:
+    """
+    Sync the local mirror of ``space`` and wrap ``client`` to use it.
+
+    Falls back to the plain client if the mirror could not be synced.
+    """
+    mirror = ConfluenceMirror(MIRROR_PATH, label=HAPPI_TO_CONFLUENCE_LABEL)
+    try:
+        mirror.sync(client, space, full=full_sync)
+    except Exception:
+        logger.warning(
+            "Failed to sync the mirror; all pages will be retrieved from "
+            "Confluence", exc_info=True
+        )
+        mirror.close()
+        return client
+    return MirroredConfluence(client, mirror)
+
+
+def main(
+    space: str,
+    root_title: str,
+    testing: bool = False,
+    time_budget: Optional[float] = None,
+    use_mirror: bool = True,
+    full_sync: bool = False,
+):
     client, root_page = initialize_client(space=space, root_title=root_title)
-    all_item_state = render_device_pages(space=space, client=client, root_page=root_page, testing=testing)
-    view_state = render_view_pages(space=space, client=client, root_page=root_page, state=all_item_state)
-    return all_item_state, view_state
+    if use_mirror:
+        client = initialize_mirror(client, space, full_sync=full_sync)
 
+    client = PublishQueue(client, space)
+    try:
+        all_item_state, completed = render_device_pages(
+            space=space, client=client, root_page=root_page, testing=testing,
+            time_budget=time_budget,
+        )
+        if not completed:
+            # Views generated from a partial state would drop devices; leave
+            # them as-is until a run gets through all devices.
+            logger.warning("Not all devices were rendered; skipping view pages")
+            return all_item_state, {}
 
-if __name__ == "__main__":
-    testing = "--test" in sys.argv
-    if "--production" in sys.argv:
-        SPACE = "PCDS"
-        DOCUMENTATION_ROOT_TITLE = "Happi Devices"
-    else:
-        SPACE = "~klauer"
-        DOCUMENTATION_ROOT_TITLE = "Typhos Documentation Root"
+        view_state = render_view_pages(space=space, client=client, root_page=root_page, state=all_item_state)
+        return all_item_state, view_state
+    finally:
+        client.flush()
+
+
+def load_happi_info(happi_info_filename: str = "happi_info.json") -> dict:
+    """Load happi item metadata by name from the whatrecord happi plugin."""
+    with open(happi_info_filename, "rt") as fp:
+        happi_info = json.load(fp)
+    # Keys for the happi plugin are the happi item names
+    return happi_info["metadata_by_key"]
+
+
+def all_templates() -> List[NamedTemplate]:
+    """All templates used in the page hierarchies, one per filename."""
+    templates = {}
+
+    def add_from(hierarchy: PageHierarchy):
+        for template, children in hierarchy.items():
+            if isinstance(template, NamedTemplate):
+                templates.setdefault(template.filename, template)
+                add_from(children)
+
+    add_from(PER_DEVICE_HIERARCHY)
+    add_from(MATCHING_NAME_AND_CLASS_HIERARCHY)
+    add_from(VIEWS)
+    templates.setdefault(docstring_template.filename, docstring_template)
+    return list(templates.values())
+
+
+def cli_validate(args: argparse.Namespace) -> int:
+    """Check that every template can be loaded and compiled."""
+    failures = 0
+    for template in all_templates():
+        try:
+            template.load()
+        except Exception as ex:
+            failures += 1
+            print(f"{template.filename}: FAILED ({ex.__class__.__name__}: {ex})")
+        else:
+            print(f"{template.filename}: OK (labels: {', '.join(template.labels)})")
+    return 1 if failures else 0
+
+
+def get_cli_space(args: argparse.Namespace) -> str:
+    """The Confluence space selected on the command line."""
+    return PRODUCTION_SPACE if args.production else SPACE
+
+
+def cli_plan(args: argparse.Namespace) -> int:
+    """Show the order devices would be worked on in the next publish."""
+    md_by_key = load_happi_info(args.happi_info)
+    published = load_publish_record(get_cli_space(args))["devices"]
+    counts = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+    for idx, (happi_name, happi_item) in enumerate(
+        prioritize_devices(md_by_key, published), 1
+    ):
+        priority = PRIORITY_NAMES[
+            get_device_priority(happi_name, happi_item, published)
+        ]
+        counts[priority] += 1
+        if args.all or priority != "unchanged":
+            print(f"{idx:5d} {priority:10s} {happi_name}")
+
+    print(", ".join(f"{count} {name}" for name, count in counts.items()))
+    return 0
+
+
+def cli_report(args: argparse.Namespace) -> int:
+    """Report on the most recent publish."""
+    record = load_publish_record(get_cli_space(args))
+    last_run = record["last_run"]
+    if not last_run:
+        print("No publish has been recorded")
+        return 0
+
+    print(f"Last run finished: {last_run['finished']}")
+    print(f"Elapsed: {last_run['elapsed']:.1f} sec")
+    print(f"Completed: {last_run['completed']}")
+    if not last_run["completed"]:
+        print(f"Stopped at: {last_run['stopped_at']}")
+        print(f"Devices remaining: {len(last_run['remaining'])}")
+    print(f"Devices published: {len(record['devices'])}")
+    return 0
+
+
+def cli_pv(args: argparse.Namespace) -> int:
+    """Find the happi devices that use the given PVs."""
+    pv_index = PVIndex.from_happi_items(load_happi_info(args.happi_info))
+    found = True
+    for pv_name in args.pv_names:
+        rows = pv_index.lookup(pv_name)
+        if not rows and args.prefix:
+            rows = pv_index.search(pv_name, limit=args.limit)
+        if not rows:
+            print(f"{pv_name}: not found")
+            found = False
+        for row in rows:
+            print(f"{row.name}: {row.device}.{row.record.get('signal', '')} ({row.kind})")
+    return 0 if found else 1
+
+
+def cli_publish(args: argparse.Namespace):
+    """Render and publish all pages to Confluence."""
+    global SPACE, DOCUMENTATION_ROOT_TITLE
+
+    if args.production:
+        SPACE = PRODUCTION_SPACE
+        DOCUMENTATION_ROOT_TITLE = PRODUCTION_DOCUMENTATION_ROOT_TITLE
 
     print(
         f"Writing to space '{SPACE}' page '{DOCUMENTATION_ROOT_TITLE}'.\n"
-        f"Single page test mode enable status: {testing}.\n"
+        f"Single page test mode enable status: {args.test}.\n"
+        f"Time budget: {args.time_budget or 'unlimited'} (sec).\n"
         f"Ctrl-C now to cancel, or press enter to continue\n"
     )
     try:
@@ -850,8 +2001,87 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         sys.exit(0)
 
-    all_item_state, view_state = main(
+    return main(
         space=SPACE,
         root_title=DOCUMENTATION_ROOT_TITLE,
-        testing=testing,
-    )  # noqa: F401
+        testing=args.test,
+        time_budget=args.time_budget,
+        use_mirror=not args.no_mirror,
+        full_sync=args.full_sync,
+    )
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Generate Confluence documentation from happi.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    publish = subparsers.add_parser("publish", help=cli_publish.__doc__)
+    publish.add_argument(
+        "--production", action="store_true",
+        help=f"Publish to {PRODUCTION_SPACE} / {PRODUCTION_DOCUMENTATION_ROOT_TITLE}",
+    )
+    publish.add_argument(
+        "--test", action="store_true",
+        help="Only render the first few devices",
+    )
+    publish.add_argument(
+        "--time-budget", type=float, default=None,
+        help="Stop cleanly after this many seconds",
+    )
+    publish.add_argument(
+        "--no-mirror", action="store_true",
+        help=f"Retrieve all pages from Confluence instead of {MIRROR_PATH}",
+    )
+    publish.add_argument(
+        "--full-sync", action="store_true",
+        help="Re-download all generated pages into the local mirror",
+    )
+    publish.set_defaults(func=cli_publish)
+
+    validate = subparsers.add_parser("validate", help=cli_validate.__doc__)
+    validate.set_defaults(func=cli_validate)
+
+    plan = subparsers.add_parser("plan", help=cli_plan.__doc__)
+    plan.add_argument("--happi-info", default="happi_info.json")
+    plan.add_argument(
+        "--production", action="store_true",
+        help=f"Plan the next publish to {PRODUCTION_SPACE}",
+    )
+    plan.add_argument(
+        "--all", action="store_true",
+        help="Include devices that are unchanged since the last publish",
+    )
+    plan.set_defaults(func=cli_plan)
+
+    pv = subparsers.add_parser("pv", help=cli_pv.__doc__)
+    pv.add_argument("pv_names", nargs="+", metavar="pv_name")
+    pv.add_argument("--happi-info", default="happi_info.json")
+    pv.add_argument(
+        "--prefix", action="store_true",
+        help="If there is no exact match, show PVs starting with pv_name",
+    )
+    pv.add_argument("--limit", type=int, default=20)
+    pv.set_defaults(func=cli_pv)
+
+    report = subparsers.add_parser("report", help=cli_report.__doc__)
+    report.add_argument(
+        "--production", action="store_true",
+        help=f"Report on the last publish to {PRODUCTION_SPACE}",
+    )
+    report.set_defaults(func=cli_report)
+    return parser
+
+
+def cli(argv: Optional[List[str]] = None):
+    logging.basicConfig(level="INFO")
+    args = build_arg_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    result = cli()
+    if isinstance(result, int):
+        sys.exit(result)
+    all_item_state, view_state = result